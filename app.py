@@ -1,9 +1,21 @@
 import os
 import json
-from flask import Flask, request, jsonify, send_from_directory
+import functools
+import hashlib
+import itertools
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from flask import Flask, Response, request, jsonify, send_from_directory
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 from pymongo import MongoClient
 import voyageai
+import numpy as np
+import orjson
+from cachetools import TTLCache
+import redis
 from bson import ObjectId
 from dotenv import load_dotenv
 import requests
@@ -11,12 +23,86 @@ import requests
 # Load environment variables from .env file
 load_dotenv()
 
+class ORJSONProvider(DefaultJSONProvider):
+    """JSON provider backed by orjson. Unsupported types such as ObjectId are stringified."""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=str, option=orjson.OPT_SERIALIZE_NUMPY).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
 app = Flask(__name__, static_folder='dist', static_url_path='')
+app.json = ORJSONProvider(app)
 CORS(app)
 
+# Embedding model for queries. Documents are embedded by the setup scripts
+# with their own EMBEDDING_MODEL; the two may differ only if the models share an
+# embedding space, so a cheaper document model can be paired with a stronger
+# query model. There is no lite multimodal Voyage model yet, so both default to
+# voyage-multimodal-3.
+QUERY_EMBEDDING_MODEL = os.getenv('QUERY_EMBEDDING_MODEL', 'voyage-multimodal-3')
+
 # Initialize Voyage AI client
 voyage_client = voyageai.Client(api_key=os.getenv('VOYAGE_API_KEY'))
 
+# Optional Redis cache for query embeddings shared across workers. Short socket
+# timeouts keep it best effort: an unreachable Redis falls through to Voyage AI
+# instead of stalling each lookup for the OS TCP timeout.
+REDIS_TIMEOUT = float(os.getenv('REDIS_TIMEOUT_MS', '100')) / 1000
+redis_client = redis.Redis.from_url(
+    os.getenv('REDIS_URL'),
+    socket_timeout=REDIS_TIMEOUT,
+    socket_connect_timeout=REDIS_TIMEOUT
+) if os.getenv('REDIS_URL') else None
+EMBEDDING_CACHE_TTL = 86400
+
+# Micro-batching window for query embeddings
+EMBED_BATCH_SIZE = int(os.getenv('EMBED_BATCH_SIZE', '32'))
+EMBED_BATCH_WAIT = float(os.getenv('EMBED_BATCH_WAIT_MS', '30')) / 1000
+# Upper bound on how long a request waits for its batch to be embedded
+EMBED_TIMEOUT = float(os.getenv('EMBED_TIMEOUT', '30'))
+
+# Static parts of the /search aggregation pipeline
+VECTOR_SEARCH_OPTIONS = {
+    "index": "vector_index",
+    "path": "embedding",
+    "numCandidates": 200,
+    "limit": 50
+}
+
+# Project only required fields
+PROJECT_STAGE = {
+    "$project": {
+        "naId": 1,
+        "title": 1,
+        "source_s3_path": 1,
+        "source_s3_paths": 1,
+        "file_type": 1,
+        "start_timestamp": 1,
+        "source_file_names": 1,
+        "score": {"$meta": "vectorSearchScore"}
+    }
+}
+
+# File type filter values that cover more than one stored file_type
+FILE_TYPE_MAP = {
+    'mp4': ('mp4', 'video_chunk'),
+}
+
+# Reranking only pays for its round trip with enough candidates, and only the
+# top of the list is worth reordering
+RERANK_MIN_CANDIDATES = int(os.getenv('RERANK_MIN_CANDIDATES', '8'))
+RERANK_TOP_K = int(os.getenv('RERANK_TOP_K', '20'))
+
+# Reranked orders keyed by a hash of the query and candidate ids, so repeated
+# searches over the same candidates skip the rerank round trip
+rerank_cache = TTLCache(maxsize=10000, ttl=600)
+rerank_cache_lock = threading.Lock()
+
+# Extra diagnostics that are too expensive to run by default
+SEARCH_DEBUG = bool(os.getenv('SEARCH_DEBUG'))
+
 # MongoDB connection
 mongo_client = None
 db = None
@@ -34,24 +120,156 @@ def init_mongo():
         mongo_client = MongoClient(connection_string)
         db = mongo_client.ts_multimodal_demo
         collection = db.nasa_archive
-        return True
     except Exception as e:
         print(f"Error connecting to MongoDB: {e}")
         return False
 
+    # MongoClient connects lazily. Warm the pool in the background so startup
+    # never waits on server selection, which would outlast the liveness probe
+    # when Atlas is unreachable.
+    threading.Thread(target=warm_up_mongo, daemon=True).start()
+    return True
+
+def warm_up_mongo():
+    try:
+        mongo_client.admin.command('ping')
+
+        # One-time sanity check, read from collection metadata rather than a scan
+        print(f"Total documents in collection: {collection.estimated_document_count()}")
+        if SEARCH_DEBUG:
+            docs_with_embeddings = collection.count_documents({"embedding": {"$exists": True}})
+            print(f"Documents with embeddings: {docs_with_embeddings}")
+    except Exception as e:
+        print(f"Error warming up MongoDB connection: {e}")
+
+class EmbeddingBatcher:
+    """
+    Coalesces embedding requests that arrive within a short window into a
+    single Voyage AI call, resolving each caller's Future with its embedding.
+    """
+
+    def __init__(self, max_batch_size, max_wait):
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def embed(self, text, model, input_type):
+        """Queue text for embedding and block until its batch completes."""
+        with self.lock:
+            # Started lazily so the thread is created in the serving process
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+        future = Future()
+        self.queue.put((text, model, input_type, future))
+        return future.result(timeout=EMBED_TIMEOUT)
+
+    def _run(self):
+        while True:
+            # Keep the only batcher thread alive whatever a batch throws,
+            # otherwise every later embedding would wait forever
+            try:
+                self._run_batch()
+            except Exception as e:
+                print(f"Error in embedding batcher: {e}")
+
+    def _run_batch(self):
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        # One API call per model/input type, embedding each distinct text once
+        groups = {}
+        for text, model, input_type, future in batch:
+            groups.setdefault((model, input_type), []).append((text, future))
+
+        for (model, input_type), pending in groups.items():
+            texts = list(dict.fromkeys(text for text, _ in pending))
+            try:
+                result = voyage_client.multimodal_embed(
+                    inputs=[[text] for text in texts],
+                    model=model,
+                    input_type=input_type
+                )
+                embeddings = dict(zip(texts, result.embeddings))
+                for text, future in pending:
+                    if not future.done():
+                        future.set_result(embeddings[text])
+            except Exception as e:
+                for _, future in pending:
+                    if not future.done():
+                        future.set_exception(e)
+
+embedding_batcher = EmbeddingBatcher(EMBED_BATCH_SIZE, EMBED_BATCH_WAIT)
+
+@functools.lru_cache(maxsize=4096)
+def cached_embedding(text, model, input_type):
+    """
+    Embed normalized text, checking Redis before calling Voyage AI.
+    Failures raise so they are never cached.
+    """
+    cache_key = f"embedding:{model}:{input_type}:{text}"
+    if redis_client is not None:
+        try:
+            cached = redis_client.get(cache_key)
+            if cached is not None:
+                return np.frombuffer(cached, dtype=np.float16).astype(np.float32).tolist()
+        except redis.RedisError as e:
+            print(f"Error reading embedding cache: {e}")
+
+    embedding = embedding_batcher.embed(text, model, input_type)
+
+    if redis_client is not None:
+        try:
+            # fp16 halves the cached bytes, well within the precision needed for ANN search
+            redis_client.set(cache_key, np.asarray(embedding, dtype=np.float16).tobytes(), ex=EMBEDDING_CACHE_TTL)
+        except redis.RedisError as e:
+            print(f"Error writing embedding cache: {e}")
+    return embedding
+
 def get_embedding(text):
     """Generate embedding using Voyage AI multimodal model"""
     try:
-        result = voyage_client.multimodal_embed(
-            inputs=[[text]],
-            model="voyage-multimodal-3",
-            input_type="query"
-        )
-        return result.embeddings[0]
+        # Normalize whitespace and case so equivalent queries share a cache entry
+        normalized_text = " ".join(text.split()).lower()
+        return cached_embedding(normalized_text, QUERY_EMBEDDING_MODEL, "query")
     except Exception as e:
         print(f"Error generating embedding: {e}")
         return None
 
+def stream_json_array(results):
+    """
+    Yield results as a JSON array one document at a time, so the client starts
+    receiving data before the cursor is exhausted.
+    """
+    print("Returning results")
+    yield '['
+    count = 0
+    for result in results:
+        # Debug: Show the structure of the first result
+        if count == 0:
+            print("First result structure:")
+            for key, value in result.items():
+                if key == 'source_s3_path':
+                    print(f"  {key}: {type(value)} = {value}")
+                else:
+                    print(f"  {key}: {type(value)}")
+        else:
+            yield ','
+        yield app.json.dumps(result)
+        count += 1
+    yield ']'
+    print(f"Returned {count} results")
+
 @app.route('/')
 def index():
     return send_from_directory(app.static_folder, 'index.html')
@@ -74,11 +292,18 @@ def search():
             return jsonify({'error': 'query_text is required'}), 400
         
         query_text = data['query_text']
+        if not isinstance(query_text, str):
+            return jsonify({'error': 'query_text must be a string'}), 400
         filter_file_types = data.get('filter_file_types')
         use_reranker = data.get('use_reranker', True) # Default to True if not provided
         print(f"Query: '{query_text}', Filter: '{filter_file_types}', Reranker: {use_reranker}")
         
-        # Generate embedding for the query
+        if collection is None:
+            print("Initializing MongoDB connection...")
+            if not init_mongo():
+                print("MongoDB connection failed")
+                return jsonify({'error': 'Database connection failed'}), 500
+        
         print("Generating embedding...")
         embedding = get_embedding(query_text)
         if not embedding:
@@ -87,117 +312,78 @@ def search():
         
         print(f"Generated embedding with length: {len(embedding)}")
         
-        # Build aggregation pipeline
-        pipeline = []
-        
-        # Vector search stage
-        vector_search_stage = {
-            "$vectorSearch": {
-                "index": "vector_index",
-                "path": "embedding",
-                "queryVector": embedding,
-                "numCandidates": 200,
-                "limit": 50
-            }
-        }
-        pipeline.append(vector_search_stage)
+        # Vector search stage, only the query vector and filter vary per request
+        vector_search = {**VECTOR_SEARCH_OPTIONS, "queryVector": embedding}
         
-        # Add file type filter if provided
+        # Add file type filter if provided. Filtering inside $vectorSearch
+        # narrows the candidates in the index instead of post-filtering the
+        # top results, so documents never enter the pipeline just to be dropped
         if filter_file_types and len(filter_file_types) > 0:
-            # Handle video_chunk mapping for mp4 filter
-            mapped_file_types = []
-            for ft in filter_file_types:
-                if ft == 'mp4':
-                    mapped_file_types.extend(['mp4', 'video_chunk'])
-                else:
-                    mapped_file_types.append(ft)
+            mapped_file_types = [m for ft in filter_file_types for m in FILE_TYPE_MAP.get(ft, (ft,))]
             
-            match_stage = {
-                "$match": {
-                    "file_type": {"$in": mapped_file_types}
-                }
+            vector_search["filter"] = {
+                "file_type": {"$in": mapped_file_types}
             }
-            pipeline.append(match_stage)
         
-        # Project only required fields
-        project_stage = {
-            "$project": {
-                "naId": 1,
-                "title": 1,
-                "source_s3_path": 1,
-                "source_s3_paths": 1,
-                "file_type": 1,
-                "start_timestamp": 1,
-                "source_file_names": 1,
-                "score": {"$meta": "vectorSearchScore"}
-            }
-        }
-        pipeline.append(project_stage)
+        pipeline = [{"$vectorSearch": vector_search}, PROJECT_STAGE]
         
         # Execute search
-        if collection is None:
-            print("Initializing MongoDB connection...")
-            if not init_mongo():
-                print("MongoDB connection failed")
-                return jsonify({'error': 'Database connection failed'}), 500
-        
         print("Executing MongoDB aggregation...")
         
-        # Debug: Check if collection has any documents
-        total_docs = collection.count_documents({})
-        print(f"Total documents in collection: {total_docs}")
-        
-        # Debug: Check if any documents have embeddings
-        docs_with_embeddings = collection.count_documents({"embedding": {"$exists": True}})
-        print(f"Documents with embeddings: {docs_with_embeddings}")
-        
         # Debug: Show the aggregation pipeline
-        print(f"Aggregation pipeline: {pipeline}")
+        if SEARCH_DEBUG:
+            print(f"Aggregation pipeline: {pipeline}")
         
-        results = list(collection.aggregate(pipeline))
-        print(f"Found {len(results)} results")
-
-        # Rerank results using Voyage reranker if enabled and there are at least 2 results
-        if use_reranker and len(results) > 1:
-            print("Reranking results with Voyage reranker...")
-            # Use the chunk_text_content or title as the text for reranking
-            texts = []
-            for r in results:
-                # Prefer chunk_text_content, fallback to title
-                text = r.get("chunk_text_content") or r.get("title") or ""
-                texts.append(text)
-            try:
-                rerank_response = voyage_client.rerank(
-                    query=query_text,
-                    documents=texts,
-                    model="rerank-lite-1"
-                )
-                # rerank_response.results is a list of RerankingResult objects, sorted by relevance
-                reranked = [results[r.index] for r in rerank_response.results]
-                results = reranked
-                print("Reranking complete.")
-            except Exception as e:
-                print(f"Reranking failed: {e}")
-        elif not use_reranker:
+        # The whole result set fits in the first batch, so it arrives in one round trip
+        cursor = collection.aggregate(pipeline, batchSize=VECTOR_SEARCH_OPTIONS["limit"])
+
+        if not use_reranker:
             print("Reranking disabled by user.")
+            # Nothing needs the full result set, stream documents as they are read
+            return Response(stream_json_array(cursor), mimetype='application/json')
 
-        # Debug: Show the structure of the first result
-        if results:
-            print("First result structure:")
-            first_result = results[0]
-            for key, value in first_result.items():
-                if key == 'source_s3_path':
-                    print(f"  {key}: {type(value)} = {value}")
-                else:
-                    print(f"  {key}: {type(value)}")
+        # Only the top candidates are reranked, the rest keep their vector search order
+        results = list(itertools.islice(cursor, RERANK_TOP_K))
+        print(f"Found {len(results)} candidates to rerank")
+
+        # Rerank results using Voyage reranker if there are enough candidates
+        if len(results) >= RERANK_MIN_CANDIDATES:
+            cache_key = hashlib.blake2b(
+                f"{query_text}|{','.join(str(r['_id']) for r in results)}".encode(),
+                digest_size=16
+            ).hexdigest()
+            with rerank_cache_lock:
+                order = rerank_cache.get(cache_key)
 
-        # Convert ObjectId to string for JSON serialization
-        for result in results:
-            if '_id' in result:
-                result['_id'] = str(result['_id'])
+            if order is not None:
+                print("Using cached rerank order.")
+                results = [results[i] for i in order]
+            else:
+                print("Reranking results with Voyage reranker...")
+                # Use the chunk_text_content or title as the text for reranking
+                texts = []
+                for r in results:
+                    # Prefer chunk_text_content, fallback to title
+                    text = r.get("chunk_text_content") or r.get("title") or ""
+                    texts.append(text)
+                try:
+                    rerank_response = voyage_client.rerank(
+                        query=query_text,
+                        documents=texts,
+                        model="rerank-lite-1"
+                    )
+                    # rerank_response.results is a list of RerankingResult objects, sorted by relevance
+                    order = [r.index for r in rerank_response.results]
+                    with rerank_cache_lock:
+                        rerank_cache[cache_key] = order
+                    results = [results[i] for i in order]
+                    print("Reranking complete.")
+                except Exception as e:
+                    print(f"Reranking failed: {e}")
+        else:
+            print("Too few candidates, skipping reranking.")
 
-        print("Returning results")
-        return jsonify(results)
+        return Response(stream_json_array(itertools.chain(results, cursor)), mimetype='application/json')
         
     except Exception as e:
         print(f"Search error: {e}")
@@ -10,12 +10,16 @@ Usage:
 Environment Variables:
     SEARCH_TERM: The search term to use (default: 'NASA')
     DATA_DIR: Base directory for data storage (default: './data')
+    DOWNLOAD_WORKERS: Number of files downloaded concurrently (default: 32)
 """
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import os
 import time
 import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 
 # --- Configuration ---
@@ -40,6 +44,12 @@ RECORDS_BASE_DIR = DATA_DIR / 'nara_records'
 DOWNLOAD_BASE_DIR.mkdir(parents=True, exist_ok=True)
 RECORDS_BASE_DIR.mkdir(parents=True, exist_ok=True)
 
+# Number of concurrent file downloads
+DOWNLOAD_WORKERS = int(os.getenv('DOWNLOAD_WORKERS', '32'))
+
+# Size of the chunks downloaded files are streamed to disk in
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
 # The specific data types to search for
 MEDIA_TYPES = [
     'mp4',
@@ -51,6 +61,18 @@ MEDIA_TYPES = [
     'gif',
 ]
 
+# Shared HTTP session: the pooled connections are reused across API calls and
+# download threads instead of a new TCP/TLS handshake per file, and transient
+# failures are retried with backoff
+SESSION = requests.Session()
+SESSION_ADAPTER = HTTPAdapter(
+    pool_connections=DOWNLOAD_WORKERS,
+    pool_maxsize=DOWNLOAD_WORKERS,
+    max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504])
+)
+SESSION.mount('https://', SESSION_ADAPTER)
+SESSION.mount('http://', SESSION_ADAPTER)
+
 # --- Helper Functions ---
 
 def download_file_requests(url, file_path):
@@ -61,16 +83,27 @@ def download_file_requests(url, file_path):
     Args:
         url (str): The URL of the file to download.
         file_path (Path): The local path to save the file.
+
+    Returns:
+        tuple: (success, message) describing the outcome of the download.
     """
     try:
-        with requests.get(url, stream=True, timeout=30) as r:
+        with SESSION.get(url, stream=True, timeout=30) as r:
             r.raise_for_status()
             with open(file_path, 'wb') as f:
-                for chunk in r.iter_content(chunk_size=8192):
+                for chunk in r.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
                     f.write(chunk)
-        print(f"Downloaded: {file_path.name}")
+        return True, f"Downloaded: {file_path.name}"
     except requests.exceptions.RequestException as e:
-        print(f"Error downloading {url}: {e}")
+        # Don't leave a partial file behind, otherwise it would be skipped on the next run
+        file_path.unlink(missing_ok=True)
+        return False, f"Error downloading {url}: {e}"
+
+def save_record_metadata(records_file_path, record_data):
+    """Writes a record's metadata dictionary to its JSON file."""
+    with open(records_file_path, 'w') as f:
+        json.dump(record_data, f, indent=4)
+    print(f"Saved metadata to: {records_file_path}")
 
 def main():
     """
@@ -79,6 +112,7 @@ def main():
     print("--- Starting NARA API Scraper ---")
     print(f"Search term: {SEARCH_TERM}")
     print(f"Data directory: {DATA_DIR}")
+    print(f"Download workers: {DOWNLOAD_WORKERS}")
     
     # Create a sub-directory for the search term in both download and records folders
     download_term_dir = DOWNLOAD_BASE_DIR / SEARCH_TERM.replace(' ', '_')
@@ -97,6 +131,10 @@ def main():
 
         download_type_dir.mkdir(parents=True, exist_ok=True)
         records_type_dir.mkdir(parents=True, exist_ok=True)
+
+        # List each directory once instead of stat()-ing every candidate file
+        existing_records = {p.name for p in records_type_dir.iterdir()}
+        existing_downloads = {p.name for p in download_type_dir.iterdir()}
         
         # Construct the API URL with search parameters
         params = {
@@ -107,7 +145,7 @@ def main():
         
         try:
             # Make the API call
-            response = requests.get(NARA_CATALOG_API_URL, params=params, timeout=30)
+            response = SESSION.get(NARA_CATALOG_API_URL, params=params, timeout=30)
             response.raise_for_status()
             data = response.json()
             
@@ -120,65 +158,105 @@ def main():
             
             print(f"Found {len(hits)} records for '{media_type}'.")
             
-            found_downloads = False
-            for record in hits:
-                record_source = record.get('_source', {}).get('record', {})
-                na_id = record_source.get('naId')
-
-                # Check for existing metadata file before processing this record
-                records_file_path = records_type_dir / f"{na_id}.json"
-                if records_file_path.exists():
-                    print(f"Metadata file already exists for NAID {na_id}. Skipping record.")
-                    continue
-                
-                digital_objects = record_source.get('digitalObjects', [])
-
-                if not digital_objects:
-                    continue
-
-                # Prepare the metadata dictionary for this record
-                record_data = {
-                    'naId': na_id,
-                    'title': record_source.get('title'),
-                    'subtitle': record_source.get('subtitle'),
-                    'scopeAndContentNote': record_source.get('scopeAndContentNote'),
-                    'useRestrictionNote': record_source.get('useRestriction', {}).get('note'),
-                    'digitalObjects': []
-                }
-                
-                # Check for digital objects and download them
-                for obj in digital_objects:
-                    obj_url = obj.get('objectUrl')
-                    obj_filename = obj.get('objectFilename')
+            # Records waiting on their downloads to finish, keyed by NAID
+            pending_records = {}
+            # Download futures keyed by file name, so a file shared by several
+            # records is downloaded once and every record waits on that download
+            downloads = {}
+            # Download futures mapped to the NAIDs of the records waiting on them
+            download_futures = {}
+
+            with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as executor:
+                for record in hits:
+                    record_source = record.get('_source', {}).get('record', {})
+                    na_id = record_source.get('naId')
+
+                    # Check for existing metadata file before processing this record
+                    records_file_path = records_type_dir / f"{na_id}.json"
+                    if records_file_path.name in existing_records:
+                        print(f"Metadata file already exists for NAID {na_id}. Skipping record.")
+                        continue
                     
-                    if obj_url and obj_filename:
-                        # Add object metadata to our dictionary
-                        record_data['digitalObjects'].append({
-                            'objectUrl': obj_url,
-                            'objectFilename': obj_filename,
-                            'objectType': obj.get('objectType'),
-                            'objectFileSize': obj.get('objectFileSize')
-                        })
-
-                        # Define the file path for downloading
-                        file_path = download_type_dir / obj_filename
+                    digital_objects = record_source.get('digitalObjects', [])
+
+                    if not digital_objects:
+                        continue
+
+                    # Prepare the metadata dictionary for this record
+                    record_data = {
+                        'naId': na_id,
+                        'title': record_source.get('title'),
+                        'subtitle': record_source.get('subtitle'),
+                        'scopeAndContentNote': record_source.get('scopeAndContentNote'),
+                        'useRestrictionNote': record_source.get('useRestriction', {}).get('note'),
+                        'digitalObjects': []
+                    }
+                    
+                    # Queue the digital objects that still need to be downloaded
+                    record_downloads = []
+                    for obj in digital_objects:
+                        obj_url = obj.get('objectUrl')
+                        obj_filename = obj.get('objectFilename')
                         
-                        # Only download if the file doesn't already exist
-                        if not file_path.exists():
-                            download_file_requests(obj_url, file_path)
-                            found_downloads = True
-                            # Add a small delay between downloads
-                            time.sleep(0.5)
-                        else:
-                            print(f"File already exists: {file_path}. Skipping download.")
-
-                # Save the metadata to a JSON file
-                if na_id:
-                    with open(records_file_path, 'w') as f:
-                        json.dump(record_data, f, indent=4)
-                    print(f"Saved metadata to: {records_file_path}")
-
-            if not found_downloads:
+                        if obj_url and obj_filename:
+                            # Add object metadata to our dictionary
+                            record_data['digitalObjects'].append({
+                                'objectUrl': obj_url,
+                                'objectFilename': obj_filename,
+                                'objectType': obj.get('objectType'),
+                                'objectFileSize': obj.get('objectFileSize')
+                            })
+
+                            # Define the file path for downloading
+                            file_path = download_type_dir / obj_filename
+                            
+                            if obj_filename in downloads:
+                                # An earlier record already queued this file; its
+                                # metadata waits on the same download
+                                record_downloads.append(downloads[obj_filename])
+                            elif obj_filename not in existing_downloads:
+                                # Only download if the file doesn't already exist
+                                future = executor.submit(download_file_requests, obj_url, file_path)
+                                downloads[obj_filename] = future
+                                download_futures[future] = []
+                                record_downloads.append(future)
+                            else:
+                                print(f"File already exists: {file_path}. Skipping download.")
+
+                    if not na_id:
+                        # No metadata file can be written, but the downloads are still useful
+                        continue
+
+                    # Nothing left to download, so the metadata can be saved right away
+                    if not record_downloads:
+                        save_record_metadata(records_file_path, record_data)
+                        continue
+
+                    pending_records[na_id] = {
+                        'records_file_path': records_file_path,
+                        'record_data': record_data,
+                        'remaining': len(record_downloads),
+                        'succeeded': True
+                    }
+                    for future in record_downloads:
+                        download_futures[future].append(na_id)
+
+                # Save each record's metadata once all of its downloads have succeeded
+                for future in as_completed(download_futures):
+                    success, message = future.result()
+                    print(message)
+
+                    for na_id in download_futures[future]:
+                        pending = pending_records[na_id]
+                        pending['remaining'] -= 1
+                        pending['succeeded'] = pending['succeeded'] and success
+                        if pending['remaining'] == 0:
+                            if pending['succeeded']:
+                                save_record_metadata(pending['records_file_path'], pending['record_data'])
+                            else:
+                                print(f"Not all files downloaded for NAID {na_id}. Metadata not saved.")
+
+            if not download_futures:
                 print(f"No new downloadable files found for '{media_type}' within the returned records.")
                 
         except requests.exceptions.RequestException as e:
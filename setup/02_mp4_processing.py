@@ -12,6 +12,9 @@ Environment Variables:
     SEARCH_TERM: The search term used for scraping (default: 'NASA')
     CHUNK_DURATION: Duration of each chunk in seconds (default: 10)
     FRAMES_PER_CHUNK: Number of frames to extract per chunk (default: 5)
+    FFMPEG_THREADS: Threads each ffmpeg job may use (default: 2)
+    VIDEO_WORKERS: Videos processed in parallel (default: CPU count / FFMPEG_THREADS)
+    FFMPEG_HWACCEL: Hardware decoder for frame extraction, e.g. 'cuda' or 'auto' (default: none)
 
 Requirements:
     - ffmpeg-python
@@ -22,6 +25,8 @@ import os
 import pathlib
 import ffmpeg
 import json
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 
 # --- Configuration ---
 
@@ -39,9 +44,180 @@ OUTPUT_DIR = DATA_DIR / 'nara_video_chunks'
 CHUNK_DURATION = int(os.getenv('CHUNK_DURATION', '10'))
 FRAMES_PER_CHUNK = int(os.getenv('FRAMES_PER_CHUNK', '5'))
 
+# Parallelism: each video is processed in its own worker process, and each
+# ffmpeg job is capped at FFMPEG_THREADS so workers don't oversubscribe the CPU
+FFMPEG_THREADS = int(os.getenv('FFMPEG_THREADS', '2'))
+# Optional hardware video decoder for frame extraction, e.g. 'cuda',
+# 'videotoolbox', 'qsv' or 'auto'. Decoded frames are copied back to system
+# memory, so the select filter and JPEG encoder are unchanged.
+FFMPEG_HWACCEL = os.getenv('FFMPEG_HWACCEL')
+
+VIDEO_WORKERS = int(os.getenv('VIDEO_WORKERS', str(max(1, (os.cpu_count() or 1) // FFMPEG_THREADS))))
+
 # Create the output directory if it doesn't exist
 OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 
+def extract_frames(video_file_path, frame_pattern, frame_interval, frame_count):
+    """
+    Extracts one frame every frame_interval seconds in a single ffmpeg pass.
+    Frames are written straight to their final paths, where frame number n is
+    the frame shown at (n - 1) * frame_interval seconds.
+
+    Args:
+        video_file_path (pathlib.Path): The source MP4 file.
+        frame_pattern (str): Numbered ffmpeg output pattern for the frames.
+        frame_interval (float): Seconds between extracted frames.
+        frame_count (int): The maximum number of frames to extract.
+    """
+    # Resample the timeline to one frame per frame_interval starting at 0. Gaps
+    # in the source timestamps (low-fps or VFR sources) repeat the last frame,
+    # so output numbers always map to the same times and never shift
+    input_args = {'threads': FFMPEG_THREADS}
+    if FFMPEG_HWACCEL:
+        input_args['hwaccel'] = FFMPEG_HWACCEL
+    stream = ffmpeg.input(str(video_file_path), **input_args)
+    stream = ffmpeg.output(
+        stream,
+        frame_pattern,
+        vf=f"fps=1/{frame_interval}:start_time=0",
+        vsync='vfr',
+        vframes=frame_count
+    )
+    ffmpeg.run(stream, capture_stdout=True, capture_stderr=True, overwrite_output=True)
+
+def extract_audio_segments(video_file_path, audio_pattern, chunk_duration):
+    """
+    Cuts the audio of a video into chunk_duration-long MP3 files in a single
+    ffmpeg pass with the segment muxer, written straight to their final paths.
+
+    Args:
+        video_file_path (pathlib.Path): The source MP4 file.
+        audio_pattern (str): Numbered ffmpeg output pattern, 0-based like the chunk ids.
+        chunk_duration (int): The duration in seconds of each segment.
+    """
+    stream = ffmpeg.input(str(video_file_path), threads=FFMPEG_THREADS)
+    stream = ffmpeg.output(
+        stream,
+        audio_pattern,
+        f='segment',
+        segment_time=chunk_duration,
+        reset_timestamps=1,
+        acodec='libmp3lame',
+        vn=None
+    )
+    ffmpeg.run(stream, capture_stdout=True, capture_stderr=True, overwrite_output=True)
+
+def process_single_video(video_file_path, output_dir, chunk_duration, frames_per_chunk):
+    """
+    Splits a single MP4 file into chunks with audio and video frames and
+    writes its metadata JSON file. Runs in a worker process.
+
+    Args:
+        video_file_path (pathlib.Path): The source MP4 file.
+        output_dir (pathlib.Path): The directory to save the output chunks.
+        chunk_duration (int): The duration in seconds of each chunk.
+        frames_per_chunk (int): The number of frames to extract per chunk.
+    """
+    original_filename = video_file_path.name
+    video_name = video_file_path.stem
+    
+    print(f"\n--- Processing video: {original_filename} ---")
+    
+    # Create a specific sub-directory for this video's chunks
+    video_output_path = output_dir / video_name
+    video_output_path.mkdir(parents=True, exist_ok=True)
+    
+    # Get the total duration of the video
+    try:
+        probe = ffmpeg.probe(str(video_file_path))
+        duration = float(probe['format']['duration'])
+        # The video stream can end before the container does; frames are only
+        # extracted up to the end of the video stream
+        video_stream = next((stream for stream in probe['streams'] if stream.get('codec_type') == 'video'), {})
+        video_duration = float(video_stream.get('duration', duration))
+    except ffmpeg.Error as e:
+        print(f"Error probing video duration for {original_filename}: {e.stderr.decode('utf8')}")
+        return
+
+    # Calculate the interval for frame extraction
+    frame_interval = chunk_duration / frames_per_chunk
+
+    # All of a video's outputs live directly in its directory, written in place
+    # by one ffmpeg job each: one MP3 per chunk and frames numbered across chunks.
+    # ffmpeg reads % in an output pattern as numbering, so any in the video's
+    # path are escaped for the patterns only.
+    ffmpeg_output_prefix = str(video_output_path / video_name).replace('%', '%%')
+    audio_pattern = f"{ffmpeg_output_prefix}_chunk_%03d.mp3"
+    frame_pattern = f"{ffmpeg_output_prefix}_frame_%04d.jpg"
+
+    # Process the video in chunks
+    chunk_metadata = {
+        "source_file": str(video_file_path),
+        "duration_seconds": duration,
+        "chunks": []
+    }
+    
+    for i, start_time in enumerate(range(0, int(duration), chunk_duration)):
+        end_time = start_time + chunk_duration
+        if end_time > duration:
+            end_time = duration
+            
+        chunk_name = f"{video_name}_chunk_{i:03d}"
+
+        print(f"  - Creating chunk {i+1} from {start_time:.2f}s to {end_time:.2f}s")
+        
+        # Audio is cut for the whole video at once below
+        audio_output_path = str(video_output_path / f"{chunk_name}.mp3")
+        
+        # Frames are extracted for the whole video at once below, numbered
+        # sequentially across chunks. Only frame times before the end of the
+        # video stream are listed, since ffmpeg never writes the rest of a
+        # partial last chunk and the resume check below would otherwise always fail
+        frame_paths = [
+            str(video_output_path / f"{video_name}_frame_{i * frames_per_chunk + j + 1:04d}.jpg")
+            for j in range(frames_per_chunk)
+            if start_time + j * frame_interval < video_duration
+        ]
+        
+        # Save chunk metadata
+        chunk_metadata["chunks"].append({
+            "chunk_id": chunk_name,
+            "start_time": start_time,
+            "end_time": end_time,
+            "audio_file": audio_output_path,
+            "frame_files": frame_paths
+        })
+        
+    # --- Extract Audio Snippets ---
+    audio_paths = [pathlib.Path(chunk["audio_file"]) for chunk in chunk_metadata["chunks"]]
+    if not all(audio_path.exists() for audio_path in audio_paths):
+        try:
+            extract_audio_segments(video_file_path, audio_pattern, chunk_duration)
+            # Drop the trailing partial second past the last whole-second chunk, if any
+            (video_output_path / f"{video_name}_chunk_{len(audio_paths):03d}.mp3").unlink(missing_ok=True)
+            print(f"  - Extracted audio for {len(audio_paths)} chunks")
+        except ffmpeg.Error as e:
+            print(f"  - Error extracting audio: {e.stderr.decode('utf8')}")
+
+    # --- Extract Video Frames ---
+    all_frame_paths = [
+        pathlib.Path(frame_path)
+        for chunk in chunk_metadata["chunks"]
+        for frame_path in chunk["frame_files"]
+    ]
+    if not all(frame_path.exists() for frame_path in all_frame_paths):
+        try:
+            extract_frames(video_file_path, frame_pattern, frame_interval, len(all_frame_paths))
+            print(f"  - Extracted frames every {frame_interval:.2f}s")
+        except ffmpeg.Error as e:
+            print(f"  - Error extracting frames: {e.stderr.decode('utf8')}")
+
+    # Save the full video's metadata JSON file
+    metadata_path = video_output_path / f"{video_name}_metadata.json"
+    with open(metadata_path, "w") as f:
+        json.dump(chunk_metadata, f, indent=4)
+    print(f"\nSaved metadata for {original_filename}")
+
 def process_video_chunks(source_dir, output_dir, chunk_duration=10, frames_per_chunk=5):
     """
     Processes all MP4 files in a source directory by splitting them into
@@ -66,87 +242,15 @@ def process_video_chunks(source_dir, output_dir, chunk_duration=10, frames_per_c
 
     print(f"Found {len(mp4_files)} MP4 files to process.")
 
-    # Loop through all MP4 files in the source directory
-    for video_file_path in mp4_files:
-        original_filename = video_file_path.name
-        video_name = video_file_path.stem
-        
-        print(f"\n--- Processing video: {original_filename} ---")
-        
-        # Create a specific sub-directory for this video's chunks
-        video_output_path = output_dir / video_name
-        video_output_path.mkdir(parents=True, exist_ok=True)
-        
-        # Get the total duration of the video
-        try:
-            probe = ffmpeg.probe(str(video_file_path))
-            duration = float(probe['format']['duration'])
-        except ffmpeg.Error as e:
-            print(f"Error probing video duration for {original_filename}: {e.stderr.decode('utf8')}")
-            continue
-
-        # Calculate the interval for frame extraction
-        frame_interval = chunk_duration / frames_per_chunk
-
-        # Process the video in chunks
-        chunk_metadata = {
-            "source_file": str(video_file_path),
-            "duration_seconds": duration,
-            "chunks": []
-        }
-        
-        for i, start_time in enumerate(range(0, int(duration), chunk_duration)):
-            end_time = start_time + chunk_duration
-            if end_time > duration:
-                end_time = duration
-                
-            chunk_name = f"{video_name}_chunk_{i:03d}"
-            chunk_output_path = video_output_path / chunk_name
-            chunk_output_path.mkdir(parents=True, exist_ok=True)
-
-            print(f"  - Creating chunk {i+1} from {start_time:.2f}s to {end_time:.2f}s")
-            
-            # --- Extract Audio Snippet ---
-            audio_output_path = chunk_output_path / f"{chunk_name}.mp3"
-            if not audio_output_path.exists():
-                try:
-                    stream = ffmpeg.input(str(video_file_path), ss=start_time, t=chunk_duration)
-                    stream = ffmpeg.output(stream, str(audio_output_path))
-                    ffmpeg.run(stream, capture_stdout=True, capture_stderr=True, overwrite_output=True)
-                    print(f"    -> Extracted audio to {audio_output_path.name}")
-                except ffmpeg.Error as e:
-                    print(f"    -> Error extracting audio: {e.stderr.decode('utf8')}")
-                    
-            # --- Extract Video Frames ---
-            frame_paths = []
-            for j in range(frames_per_chunk):
-                frame_time = start_time + (j * frame_interval)
-                frame_output_path = chunk_output_path / f"{chunk_name}_frame_{j+1}.jpg"
-                frame_paths.append(str(frame_output_path))
-
-                if not frame_output_path.exists():
-                    try:
-                        stream = ffmpeg.input(str(video_file_path), ss=frame_time)
-                        stream = ffmpeg.output(stream, str(frame_output_path), vframes=1)
-                        ffmpeg.run(stream, capture_stdout=True, capture_stderr=True, overwrite_output=True)
-                        print(f"    -> Extracted frame {j+1} at {frame_time:.2f}s")
-                    except ffmpeg.Error as e:
-                        print(f"    -> Error extracting frame: {e.stderr.decode('utf8')}")
-            
-            # Save chunk metadata
-            chunk_metadata["chunks"].append({
-                "chunk_id": chunk_name,
-                "start_time": start_time,
-                "end_time": end_time,
-                "audio_file": str(audio_output_path),
-                "frame_files": frame_paths
-            })
-            
-        # Save the full video's metadata JSON file
-        metadata_path = video_output_path / f"{video_name}_metadata.json"
-        with open(metadata_path, "w") as f:
-            json.dump(chunk_metadata, f, indent=4)
-        print(f"\nSaved metadata for {original_filename}")
+    # Process videos in parallel, each worker running its own ffmpeg jobs
+    with ProcessPoolExecutor(max_workers=VIDEO_WORKERS) as executor:
+        list(executor.map(
+            process_single_video,
+            mp4_files,
+            repeat(output_dir),
+            repeat(chunk_duration),
+            repeat(frames_per_chunk)
+        ))
 
 def main():
     """Main function to run the video processing."""
@@ -155,6 +259,8 @@ def main():
     print(f"Output directory: {OUTPUT_DIR}")
     print(f"Chunk duration: {CHUNK_DURATION} seconds")
     print(f"Frames per chunk: {FRAMES_PER_CHUNK}")
+    print(f"Video workers: {VIDEO_WORKERS}")
+    print(f"Hardware decoding: {FFMPEG_HWACCEL or 'disabled'}")
     
     process_video_chunks(SOURCE_DIR, OUTPUT_DIR, CHUNK_DURATION, FRAMES_PER_CHUNK)
     
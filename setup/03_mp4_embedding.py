@@ -17,15 +17,27 @@ Environment Variables (Optional):
     SEARCH_TERM: The search term used for scraping (default: 'NASA')
     DB_NAME: MongoDB database name (default: 'ts_multimodal_demo')
     COLLECTION_NAME: MongoDB collection name (default: 'nasa_archive')
+    MONGO_COMPRESSORS: MongoDB wire protocol compressors (default: 'zstd,zlib')
+    EMBED_BATCH_SIZE: Chunks per Voyage AI embedding request (default: 8)
+    INSERT_BATCH_SIZE: Documents per MongoDB insert_many (default: 100)
+    TRANSCRIBE_CONCURRENCY: Maximum concurrent Whisper requests (default: 8)
+    SILENCE_RMS_THRESHOLD: Audio RMS level below which Whisper is skipped (default: 0.001)
+    EMBEDDING_MODEL: Voyage AI document embedding model (default: 'voyage-multimodal-3')
 """
 
 import os
-import json
+import hashlib
 import pathlib
+import asyncio
+import ffmpeg
+import numpy as np
+import orjson
 from dotenv import load_dotenv
 import voyageai
-from openai import OpenAI
+from openai import AsyncOpenAI
 from pymongo import MongoClient
+from pymongo.errors import BulkWriteError
+from bson.binary import Binary, BinaryVectorDtype
 from PIL import Image
 
 # Load environment variables
@@ -45,9 +57,39 @@ SEARCH_TERM = os.getenv('SEARCH_TERM', 'NASA')
 NARA_RECORDS_DIR = DATA_DIR / 'nara_records' / SEARCH_TERM / 'mp4'
 NARA_CHUNKS_DIR = DATA_DIR / 'nara_video_chunks'
 
+# Whisper transcripts keyed by the SHA-1 of the audio they came from, so reruns
+# and re-embedding with another model don't pay for transcription again
+TRANSCRIPT_CACHE_DIR = DATA_DIR / 'whisper_cache'
+TRANSCRIPT_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+
+# Voyage AI model used for document embeddings. Must share an embedding space
+# with the app's QUERY_EMBEDDING_MODEL.
+EMBEDDING_MODEL = os.getenv('EMBEDDING_MODEL', 'voyage-multimodal-3')
+
+# Maximum number of Whisper requests in flight at once
+TRANSCRIBE_CONCURRENCY = int(os.getenv('TRANSCRIBE_CONCURRENCY', '8'))
+
+# Chunks whose audio RMS level (on a 0-1 scale) is below this threshold are
+# treated as silent and embedded from their frames alone without a Whisper call.
+# 0.001 is about -60 dBFS; set to 0 to transcribe every chunk.
+SILENCE_RMS_THRESHOLD = float(os.getenv('SILENCE_RMS_THRESHOLD', '0.001'))
+
+# Number of chunks sent to Voyage AI per multimodal_embed call
+EMBED_BATCH_SIZE = int(os.getenv('EMBED_BATCH_SIZE', '8'))
+
+# Number of documents buffered per MongoDB insert_many
+INSERT_BATCH_SIZE = int(os.getenv('INSERT_BATCH_SIZE', '100'))
+
 # MongoDB setup
 DB_NAME = os.getenv('DB_NAME', 'ts_multimodal_demo')
 COLLECTION_NAME = os.getenv('COLLECTION_NAME', 'nasa_archive')
+# Wire protocol compression for the bulk inserts. Embedding-heavy documents
+# compress well; pymongo skips zstd with a warning if zstandard isn't installed
+# and falls back to the standard library's zlib.
+MONGO_COMPRESSORS = os.getenv('MONGO_COMPRESSORS', 'zstd,zlib')
+
+# MongoDB error code for a unique index violation
+DUPLICATE_KEY_ERROR = 11000
 
 # Initialize API clients
 voyage_client = None
@@ -61,40 +103,318 @@ except Exception as e:
 
 try:
     if OPENAI_API_KEY:
-        openai_client = OpenAI(api_key=OPENAI_API_KEY)
+        openai_client = AsyncOpenAI(api_key=OPENAI_API_KEY)
 except Exception as e:
     print(f"Error initializing OpenAI client: {e}")
 
 def get_pil_image(image_path):
     """Opens and returns a PIL.Image object from an image file."""
     try:
-        if not os.path.exists(image_path):
-            print(f"File not found: {image_path}")
-            return None
-        
+        # Decode the pixels now so a corrupt or truncated frame is skipped on its
+        # own here rather than failing the whole batched Voyage AI call. The SDK
+        # converts every image to RGB itself when it encodes the request, so
+        # there is no conversion here.
         image = Image.open(image_path)
-        # Convert to RGB to ensure compatibility with various image formats
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
+        image.load()
         return image
     except Exception as e:
         print(f"Error opening image {image_path}: {e}")
         return None
 
-def transcribe_audio_whisper(audio_file_path):
+def is_silent(audio_file_path):
+    """
+    Decodes an audio file to mono PCM with ffmpeg and checks whether its RMS
+    level is below SILENCE_RMS_THRESHOLD.
+    """
+    if SILENCE_RMS_THRESHOLD <= 0:
+        return False
+
+    try:
+        pcm, _ = (
+            ffmpeg.input(str(audio_file_path))
+            .output('pipe:', format='s16le', ac=1, ar=16000)
+            .run(capture_stdout=True, capture_stderr=True)
+        )
+    except ffmpeg.Error as e:
+        print(f"Error decoding audio {audio_file_path}: {e.stderr.decode('utf8')}")
+        return False
+    except OSError as e:
+        # The silence check is only an optimization: without a working ffmpeg
+        # binary every chunk is transcribed as before
+        print(f"Error running ffmpeg for {audio_file_path}: {e}. Transcribing anyway.")
+        return False
+
+    samples = np.frombuffer(pcm, dtype=np.int16).astype(np.float32) / 32768
+    return samples.size == 0 or np.sqrt(np.mean(samples ** 2)) < SILENCE_RMS_THRESHOLD
+
+async def transcribe_audio_whisper(audio_file_path):
     """Transcribes an audio file using OpenAI's Whisper model."""
     try:
+        # Hand the open file to the client so the multipart upload streams it in
+        # small pieces instead of holding every in-flight chunk's audio in memory.
+        # The file is rewound if the request is retried.
         with open(audio_file_path, "rb") as audio_file:
-            transcript = openai_client.audio.transcriptions.create(
+            transcript = await openai_client.audio.transcriptions.create(
                 model="whisper-1",
-                file=audio_file
+                file=(audio_file_path.name, audio_file, "audio/mpeg")
             )
         return transcript.text
     except Exception as e:
         print(f"Error transcribing audio {audio_file_path}: {e}")
         return None
 
-def process_and_embed_video_files():
+def file_exists(file_path, chunk_dir_files):
+    """
+    Checks whether a file named in chunk metadata exists. Paths inside the
+    video's chunk directory are looked up in its listing; anything else, such
+    as metadata written with per-chunk subdirectories, falls back to a stat().
+    """
+    return str(file_path) in chunk_dir_files or file_path.exists()
+
+def audio_digest(audio_file_path):
+    """Returns the SHA-1 hex digest of an audio file, read in 64 KB blocks."""
+    digest = hashlib.sha1()
+    with open(audio_file_path, 'rb') as f:
+        for block in iter(lambda: f.read(64 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+async def transcribe_chunk(chunk_data, chunk_dir_files, semaphore):
+    """
+    Transcribes a chunk's audio, with at most TRANSCRIBE_CONCURRENCY calls in
+    flight, reusing cached transcripts of identical audio. Returns an empty
+    transcript for silent audio and None on failure.
+    """
+    audio_path = pathlib.Path(chunk_data['audio_file'])
+    if not file_exists(audio_path, chunk_dir_files):
+        print(f"    - Audio file not found at {audio_path}. Skipping chunk.")
+        return None
+
+    cache_path = TRANSCRIPT_CACHE_DIR / f"{await asyncio.to_thread(audio_digest, audio_path)}.txt"
+    if cache_path.exists():
+        print(f"    - Using cached transcript for {chunk_data['chunk_id']}.")
+        return cache_path.read_text(encoding='utf-8')
+
+    # Don't spend a Whisper call on narration gaps and ambient B-roll
+    if await asyncio.to_thread(is_silent, audio_path):
+        print(f"    - Audio for {chunk_data['chunk_id']} is silent. Skipping transcription.")
+        return ""
+
+    async with semaphore:
+        transcript = await transcribe_audio_whisper(audio_path)
+    if not transcript:
+        # An empty transcript for audio that isn't silent is treated as a failed
+        # transcription; only the silence check yields frames-only chunks
+        print(f"    - Transcription failed for {audio_path}. Skipping chunk.")
+        return None
+
+    # Write to a temporary file first so an interrupted run never leaves a
+    # truncated transcript behind
+    tmp_path = cache_path.with_suffix('.tmp')
+    tmp_path.write_text(transcript, encoding='utf-8')
+    os.replace(tmp_path, cache_path)
+    return transcript
+
+def load_frames(frame_files, chunk_dir_files):
+    """Opens a chunk's frames, dropping any that are missing or unreadable."""
+    frames = []
+    for frame_path_str in frame_files:
+        frame_path = pathlib.Path(frame_path_str)
+        if not file_exists(frame_path, chunk_dir_files):
+            print(f"File not found: {frame_path}")
+            continue
+        pil_image = get_pil_image(frame_path)
+        if pil_image:
+            frames.append(pil_image)
+    return frames
+
+async def prepare_chunk(record_metadata, obj, chunk_data, chunk_dir_files, semaphore):
+    """
+    Transcribes a chunk and loads its frames, returning the multimodal input
+    and the MongoDB document to embed, or None if the chunk can't be embedded.
+    """
+    chunk_id = chunk_data['chunk_id']
+
+    # --- 1. Transcribe Audio ---
+    transcript = await transcribe_chunk(chunk_data, chunk_dir_files, semaphore)
+    if transcript is None:
+        return None
+
+    print(f"  - Prepared chunk {chunk_id}...")
+    if transcript:
+        print(f"    - Transcript: '{transcript[:50]}...'")
+
+    # --- 2. Prepare Multimodal Input (Transcript + Frames) ---
+    # Frames are read off the event loop so other chunks keep transcribing
+    frames = await asyncio.to_thread(load_frames, chunk_data['frame_files'], chunk_dir_files)
+    # Silent chunks are embedded from their frames alone
+    input_content = ([transcript] if transcript else []) + frames
+
+    # --- 3. Check there is enough content for a multimodal embedding ---
+    if not frames:  # Check if there is at least one image alongside the transcript
+        print(f"    - Not enough content to create a multimodal embedding for {chunk_id}. Skipping.")
+        return None
+
+    # --- 4. Construct MongoDB Document ---
+    na_id = record_metadata.get('naId')
+    mongo_doc = {
+        "_id": f"{na_id}_{chunk_id}",
+        "naId": na_id,
+        "title": record_metadata.get('title'),
+        "subtitle": record_metadata.get('subtitle'),
+        "scopeAndContentNote": record_metadata.get('scopeAndContentNote'),
+        "source_file_name": obj['objectFilename'],
+        "source_s3_path": obj.get('objectUrl'),
+        "file_type": "video_chunk",
+        "chunk_text_content": transcript,
+        "start_timestamp": chunk_data['start_time'],
+        "end_timestamp": chunk_data['end_time'],
+        "embedding": None
+    }
+    return input_content, mongo_doc
+
+def embed_inputs(inputs, docs):
+    """
+    Embeds multimodal inputs with a single Voyage AI call and stores each
+    embedding on its matching document. Raises if the call fails.
+    """
+    result = voyage_client.multimodal_embed(
+        inputs=inputs,
+        model=EMBEDDING_MODEL,
+        input_type="document"
+    )
+    # Store each embedding as a packed float32 BSON vector, half the size
+    # of an array of doubles and indexed directly by Atlas Vector Search
+    for mongo_doc, embedding in zip(docs, result.embeddings):
+        mongo_doc["embedding"] = Binary.from_vector(embedding, BinaryVectorDtype.FLOAT32)
+
+def embed_batch(batch_inputs, batch_docs):
+    """
+    Embeds a batch of queued multimodal inputs with a single Voyage AI call and
+    stores each embedding on its matching document. If the batched call fails,
+    each input is retried on its own so one rejected input doesn't take its
+    batch-mates down with it. Clears the batch and returns the embedded
+    documents.
+    """
+    if not batch_inputs:
+        return []
+
+    try:
+        embed_inputs(batch_inputs, batch_docs)
+        embedded_docs = list(batch_docs)
+        print(f"    - Embedded a batch of {len(embedded_docs)} chunks.")
+    except Exception as e:
+        print(f"    - Voyage AI embedding failed: {e}. Retrying {len(batch_docs)} chunks one at a time.")
+        embedded_docs = []
+        for input_content, mongo_doc in zip(batch_inputs, batch_docs):
+            try:
+                embed_inputs([input_content], [mongo_doc])
+                embedded_docs.append(mongo_doc)
+            except Exception as e:
+                print(f"    - Voyage AI embedding failed for chunk {mongo_doc['_id']}: {e}. Skipping.")
+
+    batch_inputs.clear()
+    batch_docs.clear()
+    return embedded_docs
+
+def flush_documents(collection, pending_docs, force=False):
+    """
+    Inserts buffered documents with a single unordered insert_many once
+    INSERT_BATCH_SIZE documents are waiting, or whatever is left when force is
+    set. Failed documents are logged without aborting the rest of the batch,
+    and documents that already exist are skipped. Returns the number of
+    documents inserted.
+    """
+    if not pending_docs or (len(pending_docs) < INSERT_BATCH_SIZE and not force):
+        return 0
+
+    duplicates = 0
+    try:
+        result = collection.insert_many(pending_docs, ordered=False)
+        inserted = len(result.inserted_ids)
+    except BulkWriteError as e:
+        inserted = e.details.get('nInserted', 0)
+        for error in e.details.get('writeErrors', []):
+            # Documents another run already inserted hit the unique _id index;
+            # they are already in place, so skip them quietly
+            if error.get('code') == DUPLICATE_KEY_ERROR:
+                duplicates += 1
+                continue
+            print(f"    - Failed to insert document {error['op'].get('_id')} into MongoDB: {error.get('errmsg')}")
+    except Exception as e:
+        inserted = 0
+        print(f"    - Failed to insert {len(pending_docs)} documents into MongoDB: {e}")
+
+    print(f"    - Inserted {inserted} of {len(pending_docs)} documents into MongoDB ({duplicates} already existed).")
+    pending_docs.clear()
+    return inserted
+
+async def embedder(to_embed, to_insert):
+    """
+    Pipeline stage that waits for prepared chunks in order, embeds them in
+    batches of EMBED_BATCH_SIZE and hands the embedded documents to the writer.
+    A None on to_embed ends the stage. The writer is always told to finish,
+    even if this stage fails.
+    """
+    batch_inputs = []
+    batch_docs = []
+    try:
+        while True:
+            prepared_chunk = await to_embed.get()
+            if prepared_chunk is None:
+                break
+            # A chunk that fails to prepare (bad metadata, unreadable audio, a
+            # failed cache write) is skipped rather than stopping the pipeline
+            try:
+                prepared = await prepared_chunk
+            except Exception as e:
+                print(f"    - Failed to prepare chunk {prepared_chunk.get_name()}: {e}. Skipping chunk.")
+                continue
+            if not prepared:
+                continue
+
+            input_content, mongo_doc = prepared
+            batch_inputs.append(input_content)
+            batch_docs.append(mongo_doc)
+            if len(batch_inputs) >= EMBED_BATCH_SIZE:
+                # The Voyage AI SDK is synchronous, so embed in a worker thread while
+                # the next chunks keep transcribing
+                await to_insert.put(await asyncio.to_thread(embed_batch, batch_inputs, batch_docs))
+
+        await to_insert.put(await asyncio.to_thread(embed_batch, batch_inputs, batch_docs))
+    finally:
+        await to_insert.put(None)
+
+async def queue_for_embedding(to_embed, item, embedder_task):
+    """
+    Puts an item on the bounded to_embed queue. Returns False instead of
+    blocking forever if the embedder has stopped and will never drain it.
+    """
+    if embedder_task.done():
+        return False
+    put = asyncio.ensure_future(to_embed.put(item))
+    await asyncio.wait({put, embedder_task}, return_when=asyncio.FIRST_COMPLETED)
+    if not put.done():
+        put.cancel()
+        return False
+    return True
+
+async def writer(collection, to_insert):
+    """
+    Pipeline stage that buffers embedded documents and inserts them into
+    MongoDB in bulk. A None on to_insert flushes the remainder and ends the stage.
+    """
+    pending_docs = []
+    while True:
+        embedded_docs = await to_insert.get()
+        if embedded_docs is None:
+            break
+        pending_docs.extend(embedded_docs)
+        await asyncio.to_thread(flush_documents, collection, pending_docs)
+
+    await asyncio.to_thread(flush_documents, collection, pending_docs, force=True)
+
+async def process_and_embed_video_files():
     """
     Orchestrates the entire process: reads metadata, transcribes audio,
     creates multimodal embeddings, and inserts documents into MongoDB.
@@ -110,7 +430,7 @@ def process_and_embed_video_files():
 
     # MongoDB connection setup
     try:
-        mongo_client = MongoClient(MONGO_CONNECTION_STRING)
+        mongo_client = MongoClient(MONGO_CONNECTION_STRING, compressors=MONGO_COMPRESSORS, retryWrites=True)
         db = mongo_client[DB_NAME]
         collection = db[COLLECTION_NAME]
         print(f"Connected to MongoDB Atlas: {DB_NAME}.{COLLECTION_NAME}")
@@ -130,118 +450,94 @@ def process_and_embed_video_files():
 
     print(f"Found {len(record_files)} metadata files to process.")
 
-    # Iterate through all JSON metadata files
-    for metadata_file_path in record_files:
-        try:
-            with open(metadata_file_path, 'r') as f:
-                record_metadata = json.load(f)
-        except Exception as e:
-            print(f"Error reading metadata file {metadata_file_path}: {e}. Skipping.")
-            continue
-        
-        na_id = record_metadata.get('naId')
-        
-        # Filter for MP4 files only
-        digital_objects = [
-            obj for obj in record_metadata.get('digitalObjects', [])
-            if obj.get('objectFilename', '').endswith('.mp4')
-        ]
+    semaphore = asyncio.Semaphore(TRANSCRIBE_CONCURRENCY)
 
-        if not digital_objects:
-            continue
+    # Chunks flow through a pipeline so transcription, frame loading, Voyage AI
+    # embedding and MongoDB inserts all overlap instead of running one after the
+    # other. to_embed holds chunk preparation tasks in order and is bounded so
+    # transcription runs only a few batches ahead of the embedder.
+    to_embed = asyncio.Queue(maxsize=EMBED_BATCH_SIZE * 4)
+    to_insert = asyncio.Queue()
+    embedder_task = asyncio.create_task(embedder(to_embed, to_insert))
+    writer_task = asyncio.create_task(writer(collection, to_insert))
 
-        print(f"\nProcessing record NAID: {na_id} with {len(digital_objects)} MP4 files.")
-        
-        for obj in digital_objects:
-            video_filename = obj['objectFilename']
-            video_name = pathlib.Path(video_filename).stem
-            
-            # Find the corresponding chunk directory
-            video_chunks_dir = NARA_CHUNKS_DIR / video_name
-            if not video_chunks_dir.exists():
-                print(f"  - No chunk directory found for {video_name}. Skipping.")
+    try:
+        # Iterate through all JSON metadata files
+        for metadata_file_path in record_files:
+            try:
+                raw_metadata = metadata_file_path.read_bytes()
+                # Most records in a mixed archive have no MP4 objects at all, so
+                # skip them before paying for a full parse
+                if b'.mp4' not in raw_metadata:
+                    continue
+                record_metadata = orjson.loads(raw_metadata)
+            except Exception as e:
+                print(f"Error reading metadata file {metadata_file_path}: {e}. Skipping.")
                 continue
+        
+            na_id = record_metadata.get('naId')
+        
+            # Filter for MP4 files only
+            digital_objects = [
+                obj for obj in record_metadata.get('digitalObjects', [])
+                if obj.get('objectFilename', '').endswith('.mp4')
+            ]
 
-            # Load the chunk metadata JSON
-            chunk_metadata_path = video_chunks_dir / f"{video_name}_metadata.json"
-            if not chunk_metadata_path.exists():
-                print(f"  - No metadata file found for {video_name}. Skipping.")
+            if not digital_objects:
                 continue
 
-            with open(chunk_metadata_path, 'r') as f:
-                video_metadata = json.load(f)
-
-            # Loop through each chunk within the video
-            for chunk_data in video_metadata['chunks']:
-                chunk_id = chunk_data['chunk_id']
-                
-                # Check if this chunk has already been embedded and inserted
-                if collection.find_one({'_id': f"{na_id}_{chunk_id}"}):
-                    print(f"  - Chunk {chunk_id} already exists in DB. Skipping.")
+            print(f"\nProcessing record NAID: {na_id} with {len(digital_objects)} MP4 files.")
+        
+            for obj in digital_objects:
+                video_filename = obj['objectFilename']
+                video_name = pathlib.Path(video_filename).stem
+            
+                # Find the corresponding chunk directory and list it once. All of
+                # the video's files live directly in it, so the existence checks
+                # for its metadata, audio and frames are set lookups of their
+                # full paths rather than a stat() call per file.
+                video_chunks_dir = NARA_CHUNKS_DIR / video_name
+                try:
+                    chunk_dir_files = {entry.path for entry in os.scandir(video_chunks_dir)}
+                except FileNotFoundError:
+                    print(f"  - No chunk directory found for {video_name}. Skipping.")
                     continue
 
-                print(f"  - Embedding chunk {chunk_id}...")
-                
-                # --- 1. Transcribe Audio ---
-                audio_path = pathlib.Path(chunk_data['audio_file'])
-                if not audio_path.exists():
-                    print(f"    - Audio file not found at {audio_path}. Skipping chunk.")
+                # Load the chunk metadata JSON
+                chunk_metadata_path = video_chunks_dir / f"{video_name}_metadata.json"
+                if str(chunk_metadata_path) not in chunk_dir_files:
+                    print(f"  - No metadata file found for {video_name}. Skipping.")
                     continue
 
-                transcript = transcribe_audio_whisper(audio_path)
-                if not transcript:
-                    print(f"    - Transcription failed for {audio_path}. Skipping chunk.")
-                    continue
-                print(f"    - Transcript: '{transcript[:50]}...'")
-
-                # --- 2. Prepare Multimodal Input (Transcript + Frames) ---
-                input_content = [transcript]  # Start with the text transcript
-                
-                # Get PIL Image objects for all frames
-                for frame_path_str in chunk_data['frame_files']:
-                    frame_path = pathlib.Path(frame_path_str)
-                    pil_image = get_pil_image(frame_path)
-                    if pil_image:
-                        input_content.append(pil_image)
-
-                # --- 3. Create Multimodal Embedding with Voyage AI ---
-                if len(input_content) < 2:  # Check if there is at least a transcript and one image
-                    print(f"    - Not enough content to create a multimodal embedding for {chunk_id}. Skipping.")
-                    continue
-                
-                try:
-                    result = voyage_client.multimodal_embed(
-                        inputs=[input_content],
-                        model="voyage-multimodal-3",
-                        input_type="document"
+                video_metadata = orjson.loads(chunk_metadata_path.read_bytes())
+
+                # Skip chunks that have already been embedded and inserted, looked
+                # up with one query for the whole video
+                candidate_ids = [f"{na_id}_{chunk_data['chunk_id']}" for chunk_data in video_metadata['chunks']]
+                existing_ids = set(await asyncio.to_thread(collection.distinct, '_id', {'_id': {'$in': candidate_ids}}))
+                pending_chunks = []
+                for chunk_data in video_metadata['chunks']:
+                    if f"{na_id}_{chunk_data['chunk_id']}" in existing_ids:
+                        print(f"  - Chunk {chunk_data['chunk_id']} already exists in DB. Skipping.")
+                    else:
+                        pending_chunks.append(chunk_data)
+
+                # Queue the video's chunks; up to TRANSCRIBE_CONCURRENCY of them are
+                # transcribed at once while earlier batches are embedded and inserted
+                print(f"  - Queuing {len(pending_chunks)} chunks of {video_name}...")
+                for chunk_data in pending_chunks:
+                    prepared_chunk = asyncio.create_task(
+                        prepare_chunk(record_metadata, obj, chunk_data, chunk_dir_files, semaphore),
+                        name=f"{na_id}_{chunk_data.get('chunk_id')}"
                     )
-                    embedding = result.embeddings[0]
-                except Exception as e:
-                    print(f"    - Voyage AI embedding failed: {e}. Skipping chunk.")
-                    continue
-
-                # --- 4. Construct MongoDB Document ---
-                mongo_doc = {
-                    "_id": f"{na_id}_{chunk_id}",
-                    "naId": na_id,
-                    "title": record_metadata.get('title'),
-                    "subtitle": record_metadata.get('subtitle'),
-                    "scopeAndContentNote": record_metadata.get('scopeAndContentNote'),
-                    "source_file_name": video_filename,
-                    "source_s3_path": obj.get('objectUrl'),
-                    "file_type": "video_chunk",
-                    "chunk_text_content": transcript,
-                    "start_timestamp": chunk_data['start_time'],
-                    "end_timestamp": chunk_data['end_time'],
-                    "embedding": embedding
-                }
-                
-                # --- 5. Insert into MongoDB ---
-                try:
-                    collection.insert_one(mongo_doc)
-                    print(f"    - Successfully inserted chunk {chunk_id} into MongoDB.")
-                except Exception as e:
-                    print(f"    - Failed to insert chunk {chunk_id} into MongoDB: {e}")
+                    if not await queue_for_embedding(to_embed, prepared_chunk, embedder_task):
+                        prepared_chunk.cancel()
+                        # Surface whatever stopped the embedder
+                        await embedder_task
+                        raise RuntimeError("Embedding stage stopped unexpectedly")
+    finally:
+        await queue_for_embedding(to_embed, None, embedder_task)
+        await asyncio.gather(embedder_task, writer_task)
 
     print("\n--- Video embedding complete ---")
 
@@ -252,8 +548,9 @@ def main():
     print(f"Records directory: {NARA_RECORDS_DIR}")
     print(f"Chunks directory: {NARA_CHUNKS_DIR}")
     print(f"MongoDB: {DB_NAME}.{COLLECTION_NAME}")
+    print(f"Embedding model: {EMBEDDING_MODEL}")
     
-    process_and_embed_video_files()
+    asyncio.run(process_and_embed_video_files())
 
 if __name__ == "__main__":
     main()
@@ -16,21 +16,40 @@ Environment Variables (Optional):
     SEARCH_TERM: The search term used for scraping (default: 'NASA')
     DB_NAME: MongoDB database name (default: 'ts_multimodal_demo')
     COLLECTION_NAME: MongoDB collection name (default: 'nasa_archive')
+    MONGO_COMPRESSORS: MongoDB wire protocol compressors (default: 'zstd,zlib')
+    EMBED_BATCH_SIZE: Records per Voyage AI embedding request (default: 8)
+    INSERT_BATCH_SIZE: Documents per MongoDB insert_many (default: 100)
+    EMBEDDING_MODEL: Voyage AI document embedding model (default: 'voyage-multimodal-3')
     MAX_IMAGE_DIM: Maximum dimension for image resizing (default: 2048)
+    RESIZE_QUALITY: Resampling filter for downscaling, e.g. 'lanczos' (default: 'bilinear')
+    RECORD_WORKERS: Processes that decode images and render PDF pages in parallel (default: CPU count)
 
 Requirements:
     - PyMuPDF (fitz) for PDF processing
+    - pyvips (optional) for faster decoding and resizing of large images
 """
 
 import os
 import json
 import pathlib
+from collections import deque
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from dotenv import load_dotenv
 import voyageai
 from pymongo import MongoClient
+from pymongo.errors import BulkWriteError
+from bson.binary import Binary, BinaryVectorDtype
 from PIL import Image
 import fitz  # PyMuPDF
 
+# Optional: libvips decodes and shrinks large scans much faster than Pillow,
+# streaming the image instead of holding the full-size raster in memory
+try:
+    import pyvips
+except (ImportError, OSError):
+    pyvips = None
+
 # Load environment variables
 load_dotenv()
 
@@ -47,13 +66,55 @@ SEARCH_TERM = os.getenv('SEARCH_TERM', 'NASA')
 NARA_RECORDS_DIR = DATA_DIR / 'nara_records' / SEARCH_TERM
 NARA_DOWNLOADS_DIR = DATA_DIR / 'nara_downloads' / SEARCH_TERM
 
+# Voyage AI model used for document embeddings. Must share an embedding space
+# with the app's QUERY_EMBEDDING_MODEL.
+EMBEDDING_MODEL = os.getenv('EMBEDDING_MODEL', 'voyage-multimodal-3')
+
+# Number of records sent to Voyage AI per multimodal_embed call
+EMBED_BATCH_SIZE = int(os.getenv('EMBED_BATCH_SIZE', '8'))
+
+# Number of documents buffered per MongoDB insert_many
+INSERT_BATCH_SIZE = int(os.getenv('INSERT_BATCH_SIZE', '100'))
+
 # MongoDB setup
 DB_NAME = os.getenv('DB_NAME', 'ts_multimodal_demo')
 COLLECTION_NAME = os.getenv('COLLECTION_NAME', 'nasa_archive')
+# Wire protocol compression for the bulk inserts. Embedding-heavy documents
+# compress well; pymongo skips zstd with a warning if zstandard isn't installed
+# and falls back to the standard library's zlib.
+MONGO_COMPRESSORS = os.getenv('MONGO_COMPRESSORS', 'zstd,zlib')
+
+# MongoDB error code for a unique index violation
+DUPLICATE_KEY_ERROR = 11000
 
 # Image resizing parameters
 MAX_IMAGE_DIM = int(os.getenv('MAX_IMAGE_DIM', '2048'))
 
+# Resampling filter used when downscaling. Voyage AI downsamples images again
+# internally, so BILINEAR is visually close to LANCZOS at a fraction of the
+# cost. Any Pillow filter name is accepted, e.g. 'lanczos', 'bicubic' or 'box'.
+RESIZE_QUALITY = os.getenv('RESIZE_QUALITY', 'bilinear')
+RESIZE_FILTERS = {resampling.name.lower(): resampling for resampling in Image.Resampling}
+if RESIZE_QUALITY.lower() not in RESIZE_FILTERS:
+    raise SystemExit(
+        f"Error: Invalid RESIZE_QUALITY '{RESIZE_QUALITY}'. "
+        f"Allowed values: {', '.join(RESIZE_FILTERS)}"
+    )
+RESIZE_FILTER = RESIZE_FILTERS[RESIZE_QUALITY.lower()]
+
+# How each supported file extension is turned into images
+SUFFIX_MAP = {
+    '.pdf': 'pdf',
+    '.jpg': 'image',
+    '.jpeg': 'image',
+    '.gif': 'image'
+}
+
+# Worker processes that decode and resize images and render PDF pages in
+# parallel. Long PDFs are split into page ranges across the workers. Voyage AI
+# calls and MongoDB inserts stay in the main process.
+RECORD_WORKERS = int(os.getenv('RECORD_WORKERS', str(os.cpu_count() or 1)))
+
 # Initialize API client
 voyage_client = None
 
@@ -65,19 +126,26 @@ except Exception as e:
 
 def resize_image(image: Image.Image, max_dim: int) -> Image.Image:
     """
-    Resizes an image to a maximum dimension while maintaining aspect ratio.
+    Downscales an image in place to a maximum dimension while maintaining
+    aspect ratio, using the RESIZE_QUALITY resampling filter.
     """
-    width, height = image.size
-    if width > max_dim or height > max_dim:
-        if width > height:
-            new_width = max_dim
-            new_height = int(height * (max_dim / width))
-        else:
-            new_height = max_dim
-            new_width = int(width * (max_dim / height))
-        return image.resize((new_width, new_height), Image.Resampling.LANCZOS)
+    image.thumbnail((max_dim, max_dim), RESIZE_FILTER)
     return image
 
+def load_image_with_vips(image_path, max_dim):
+    """
+    Decodes and downscales an image with libvips and returns it as an RGB
+    PIL.Image. Only the first page/frame is loaded.
+    """
+    # thumbnail shrinks on load where the format allows it (JPEG, WebP, ...) and
+    # never upscales
+    vips_image = pyvips.Image.thumbnail(str(image_path), max_dim, size='down')
+    # Normalize 16-bit, grayscale, CMYK and alpha images to 8-bit RGB
+    vips_image = vips_image.colourspace('srgb')
+    if vips_image.bands > 3:
+        vips_image = vips_image.extract_band(0, n=3)
+    return Image.frombytes('RGB', (vips_image.width, vips_image.height), vips_image.write_to_memory())
+
 def get_pil_image_from_path(image_path):
     """
     Opens and returns a resized PIL.Image object from an image file path.
@@ -86,9 +154,20 @@ def get_pil_image_from_path(image_path):
         if not os.path.exists(image_path):
             print(f"  - File not found: {image_path}")
             return None
+
+        if pyvips:
+            return load_image_with_vips(image_path, MAX_IMAGE_DIM)
         
         image = Image.open(image_path)
-        if image.mode != 'RGB':
+        # Let the JPEG decoder downscale by a power of two while decoding, as
+        # close to MAX_IMAGE_DIM as it can get without going below it. This is a
+        # no-op for other formats.
+        image.draft('RGB', (MAX_IMAGE_DIM, MAX_IMAGE_DIM))
+        # Only the first frame of an animated GIF is embedded
+        image.seek(0)
+        # RGB and grayscale images can be embedded as they are; converting them
+        # would only force an extra decode and copy
+        if image.mode not in ('RGB', 'L'):
             image = image.convert('RGB')
             
         # Resize the image before returning
@@ -98,30 +177,189 @@ def get_pil_image_from_path(image_path):
         print(f"  - Error opening image {image_path}: {e}")
         return None
 
-def get_pil_images_from_pdf(pdf_path):
+def get_pdf_page_ranges(pdf_path):
     """
-    Converts each page of a PDF into a resized PIL.Image object.
+    Splits a PDF's pages into up to RECORD_WORKERS contiguous ranges, so a long
+    document is rendered by several worker processes at once.
     """
     try:
         if not os.path.exists(pdf_path):
             print(f"  - PDF file not found: {pdf_path}")
-            return None
-            
+            return []
+
+        with fitz.open(pdf_path) as doc:
+            page_count = doc.page_count
+    except Exception as e:
+        print(f"  - Error processing PDF {pdf_path}: {e}")
+        return []
+
+    pages_per_range = max(1, -(-page_count // RECORD_WORKERS))
+    return [
+        range(start, min(start + pages_per_range, page_count))
+        for start in range(0, page_count, pages_per_range)
+    ]
+
+def get_pil_images_from_pdf(pdf_path, page_numbers):
+    """
+    Converts a range of pages of a PDF into resized PIL.Image objects. Runs in a
+    worker process, which opens its own copy of the document.
+    """
+    try:
         doc = fitz.open(pdf_path)
-        images = []
-        for page_num in range(doc.page_count):
-            pix = doc[page_num].get_pixmap()
-            img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-            
-            # Resize the image before appending
-            resized_img = resize_image(img, MAX_IMAGE_DIM)
-            images.append(resized_img)
+        pages = []
+        for page_number in page_numbers:
+            page = doc[page_number]
+            # Render oversized pages straight at MAX_IMAGE_DIM instead of
+            # rasterizing them at full size and downscaling afterwards. Zoom is
+            # capped at 1 so normal pages keep their default 72 DPI render.
+            zoom = min(1.0, MAX_IMAGE_DIM / max(page.rect.width, page.rect.height))
+            pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+            # Wrap the pixmap's samples instead of copying them into a new image
+            pages.append(Image.frombuffer("RGB", (pix.width, pix.height), pix.samples, "raw", "RGB", pix.stride, 1))
         doc.close()
-        return images
+
+        # Pages are already close to size; resize any that still exceed
+        # MAX_IMAGE_DIM after rounding
+        return [resize_image(page_image, MAX_IMAGE_DIM) for page_image in pages]
     except Exception as e:
-        print(f"  - Error processing PDF {pdf_path}: {e}")
+        print(f"  - Error processing PDF {pdf_path} pages {page_numbers.start + 1}-{page_numbers.stop}: {e}")
         return None
 
+def submit_record_images(executor, record_metadata, file_extension):
+    """
+    Queues the decoding and resizing of every image and PDF page range of a
+    record's digital objects on the worker processes. Returns (kind, future)
+    pairs in the order the images belong in the record.
+    """
+    jobs = []
+
+    for obj in record_metadata.get('digitalObjects', []):
+        filename = obj.get('objectFilename')
+    
+        if filename:
+            local_file_path = NARA_DOWNLOADS_DIR / file_extension / filename
+            # Normalize extension to lowercase for type matching
+            kind = SUFFIX_MAP.get(os.path.splitext(filename)[1].lower())
+        
+            if kind == 'pdf':
+                for page_numbers in get_pdf_page_ranges(local_file_path):
+                    jobs.append((kind, executor.submit(get_pil_images_from_pdf, local_file_path, page_numbers)))
+            elif kind == 'image':
+                jobs.append((kind, executor.submit(get_pil_image_from_path, local_file_path)))
+
+    return jobs
+
+def collect_record_images(jobs):
+    """
+    Waits for a record's queued jobs and returns its images in order.
+    """
+    pil_images = []
+
+    for kind, future in jobs:
+        if kind == 'pdf':
+            images_from_pdf = future.result()
+            if images_from_pdf:
+                pil_images.extend(images_from_pdf)
+        else:
+            image = future.result()
+            if image:
+                pil_images.append(image)
+
+    return pil_images
+
+def iter_record_images(executor, records, file_extension):
+    """
+    Yields (record_metadata, pil_images) for each record in order, preparing
+    records in the worker processes. Only a couple of records per worker are
+    in flight at once so decoded images don't pile up in memory.
+    """
+    in_flight = deque()
+    for record_metadata in records:
+        in_flight.append((record_metadata, submit_record_images(executor, record_metadata, file_extension)))
+        if len(in_flight) >= RECORD_WORKERS * 2:
+            record_metadata, jobs = in_flight.popleft()
+            yield record_metadata, collect_record_images(jobs)
+
+    while in_flight:
+        record_metadata, jobs = in_flight.popleft()
+        yield record_metadata, collect_record_images(jobs)
+
+def embed_inputs(inputs, docs):
+    """
+    Embeds multimodal inputs with a single Voyage AI call and stores each
+    embedding on its matching document. Raises if the call fails.
+    """
+    result = voyage_client.multimodal_embed(
+        inputs=inputs,
+        model=EMBEDDING_MODEL,
+        input_type="document"
+    )
+    # Store each embedding as a packed float32 BSON vector, half the size
+    # of an array of doubles and indexed directly by Atlas Vector Search
+    for mongo_doc, embedding in zip(docs, result.embeddings):
+        mongo_doc["embedding"] = Binary.from_vector(embedding, BinaryVectorDtype.FLOAT32)
+
+def embed_batch(batch_inputs, batch_docs):
+    """
+    Embeds a batch of queued multimodal inputs with a single Voyage AI call and
+    stores each embedding on its matching document. If the batched call fails,
+    each input is retried on its own so one rejected input doesn't take its
+    batch-mates down with it. Clears the batch and returns the embedded
+    documents.
+    """
+    if not batch_inputs:
+        return []
+
+    try:
+        embed_inputs(batch_inputs, batch_docs)
+        embedded_docs = list(batch_docs)
+        print(f"  - Embedded a batch of {len(embedded_docs)} records.")
+    except Exception as e:
+        print(f"  - Voyage AI embedding failed: {e}. Retrying {len(batch_docs)} records one at a time.")
+        embedded_docs = []
+        for input_content, mongo_doc in zip(batch_inputs, batch_docs):
+            try:
+                embed_inputs([input_content], [mongo_doc])
+                embedded_docs.append(mongo_doc)
+            except Exception as e:
+                print(f"  - Voyage AI embedding failed for record {mongo_doc['_id']}: {e}. Skipping.")
+
+    batch_inputs.clear()
+    batch_docs.clear()
+    return embedded_docs
+
+def flush_documents(collection, pending_docs, force=False):
+    """
+    Inserts buffered documents with a single unordered insert_many once
+    INSERT_BATCH_SIZE documents are waiting, or whatever is left when force is
+    set. Failed documents are logged without aborting the rest of the batch,
+    and documents that already exist are skipped. Returns the number of
+    documents inserted.
+    """
+    if not pending_docs or (len(pending_docs) < INSERT_BATCH_SIZE and not force):
+        return 0
+
+    duplicates = 0
+    try:
+        result = collection.insert_many(pending_docs, ordered=False)
+        inserted = len(result.inserted_ids)
+    except BulkWriteError as e:
+        inserted = e.details.get('nInserted', 0)
+        for error in e.details.get('writeErrors', []):
+            # Documents another run already inserted hit the unique _id index;
+            # they are already in place, so skip them quietly
+            if error.get('code') == DUPLICATE_KEY_ERROR:
+                duplicates += 1
+                continue
+            print(f"  - Failed to insert document {error['op'].get('_id')} into MongoDB: {error.get('errmsg')}")
+    except Exception as e:
+        inserted = 0
+        print(f"  - Failed to insert {len(pending_docs)} documents into MongoDB: {e}")
+
+    print(f"  - Inserted {inserted} of {len(pending_docs)} documents into MongoDB ({duplicates} already existed).")
+    pending_docs.clear()
+    return inserted
+
 def process_and_embed_media_files():
     """
     Reads metadata, creates multimodal embeddings for media files (PDF, JPG, GIF),
@@ -138,9 +376,11 @@ def process_and_embed_media_files():
 
     # MongoDB connection setup
     try:
-        mongo_client = MongoClient(MONGO_CONNECTION_STRING)
+        mongo_client = MongoClient(MONGO_CONNECTION_STRING, compressors=MONGO_COMPRESSORS, retryWrites=True)
         db = mongo_client[DB_NAME]
         collection = db[COLLECTION_NAME]
+        # Backs the per-directory lookup of already embedded NAIDs
+        collection.create_index([('naId', 1), ('file_type', 1)])
         print(f"Connected to MongoDB Atlas: {DB_NAME}.{COLLECTION_NAME}")
     except Exception as e:
         print(f"Error connecting to MongoDB: {e}")
@@ -151,98 +391,98 @@ def process_and_embed_media_files():
         print(f"Error: NARA_RECORDS_DIR does not exist at {NARA_RECORDS_DIR}")
         return
     
-    # Iterate through all media types (subdirectories) in the records directory
-    # Skip the mov, mp3, and mp4 directories as they are handled by other scripts
     processed_count = 0
-    for media_type_dir in NARA_RECORDS_DIR.iterdir():
-        if not media_type_dir.is_dir() or media_type_dir.name in ['mp4', 'mov', 'mp3', 'ascii']:
-            continue
+    # Record inputs and their documents waiting to be embedded in one call
+    batch_inputs = []
+    batch_docs = []
+    # Embedded documents waiting to be inserted in bulk
+    pending_docs = []
+    # Spawn rather than fork the workers: the MongoClient above already runs
+    # background monitor threads, and forking a threaded process can deadlock
+    executor = ProcessPoolExecutor(
+        max_workers=RECORD_WORKERS,
+        mp_context=multiprocessing.get_context('spawn')
+    )
+
+    try:
+        # Iterate through all media types (subdirectories) in the records directory
+        # Skip the mov, mp3, and mp4 directories as they are handled by other scripts
+        for media_type_dir in NARA_RECORDS_DIR.iterdir():
+            if not media_type_dir.is_dir() or media_type_dir.name in ['mp4', 'mov', 'mp3', 'ascii']:
+                continue
             
-        file_extension = media_type_dir.name.lower()
-        print(f"\n--- Processing '{file_extension}' files ---")
+            file_extension = media_type_dir.name.lower()
+            print(f"\n--- Processing '{file_extension}' files ---")
         
-        metadata_files = list(media_type_dir.glob("*.json"))
-        if not metadata_files:
-            print(f"  - No metadata files found in {media_type_dir}")
-            continue
-            
-        for metadata_file_path in metadata_files:
-            with open(metadata_file_path, 'r') as f:
-                record_metadata = json.load(f)
-            
-            na_id = record_metadata.get('naId')
-            
-            # Check if a document for this NAID already exists to avoid re-embedding
-            if collection.find_one({'naId': na_id, 'file_type': {'$in': ['pdf', 'jpg', 'gif']}}):
-                print(f"  - Document for NAID {na_id} already exists in DB. Skipping.")
+            metadata_files = list(media_type_dir.glob("*.json"))
+            if not metadata_files:
+                print(f"  - No metadata files found in {media_type_dir}")
                 continue
             
-            print(f"  - Processing record NAID: {na_id}")
-            
-            digital_objects = record_metadata.get('digitalObjects', [])
-            if not digital_objects:
-                print(f"  - No digital objects found for NAID {na_id}. Skipping.")
-                continue
+            records = []
+            for metadata_file_path in metadata_files:
+                with open(metadata_file_path, 'r') as f:
+                    records.append(json.load(f))
 
-            # --- Prepare Multimodal Input (Images) ---
-            pil_images = []
-            
-            for obj in digital_objects:
-                filename = obj.get('objectFilename')
-                
-                # Normalize extension to lowercase for path matching
-                if filename:
-                    local_file_path = NARA_DOWNLOADS_DIR / file_extension / filename
-                    
-                    if filename.lower().endswith('.pdf'):
-                        images_from_pdf = get_pil_images_from_pdf(local_file_path)
-                        if images_from_pdf:
-                            pil_images.extend(images_from_pdf)
-                    elif filename.lower().endswith(('.jpg', '.jpeg', '.gif')):
-                        image = get_pil_image_from_path(local_file_path)
-                        if image:
-                            pil_images.append(image)
-
-            if not pil_images:
-                print(f"  - No valid images found for embedding for NAID {na_id}. Skipping.")
-                continue
+            # Look up which of the directory's NAIDs already have a document in a
+            # single query, rather than one round trip per record
+            existing_na_ids = set(collection.distinct('naId', {
+                'naId': {'$in': [record.get('naId') for record in records]},
+                'file_type': {'$in': ['pdf', 'jpg', 'gif']}
+            }))
+
+            records_to_embed = []
+            for record_metadata in records:
+                na_id = record_metadata.get('naId')
             
-            print(f"  - Preparing to embed {len(pil_images)} image(s) for NAID {na_id}.")
+                # Skip records that have already been embedded to avoid re-embedding
+                if na_id in existing_na_ids:
+                    print(f"  - Document for NAID {na_id} already exists in DB. Skipping.")
+                    continue
             
-            # --- Create Multimodal Embedding with Voyage AI ---
-            try:
-                # The input is a list of PIL.Image objects
-                result = voyage_client.multimodal_embed(
-                    inputs=[pil_images], 
-                    model="voyage-multimodal-3",
-                    input_type="document"
-                )
-                embedding = result.embeddings[0]
-            except Exception as e:
-                print(f"  - Voyage AI embedding failed: {e}. Skipping record.")
-                continue
+                if not record_metadata.get('digitalObjects'):
+                    print(f"  - No digital objects found for NAID {na_id}. Skipping.")
+                    continue
+
+                records_to_embed.append(record_metadata)
 
-            # --- Construct MongoDB Document ---
-            # Create a single document for the entire record's media files
-            mongo_doc = {
-                "_id": f"{na_id}",
-                "naId": na_id,
-                "title": record_metadata.get('title'),
-                "subtitle": record_metadata.get('subtitle'),
-                "scopeAndContentNote": record_metadata.get('scopeAndContentNote'),
-                "source_file_names": [obj.get('objectFilename') for obj in digital_objects],
-                "source_s3_paths": [obj.get('objectUrl') for obj in digital_objects],
-                "file_type": file_extension,
-                "embedding": embedding
-            }
+            # --- Prepare Multimodal Input (Images) in worker processes ---
+            for record_metadata, pil_images in iter_record_images(executor, records_to_embed, file_extension):
+                na_id = record_metadata.get('naId')
+                digital_objects = record_metadata['digitalObjects']
+                print(f"  - Processing record NAID: {na_id}")
+
+                if not pil_images:
+                    print(f"  - No valid images found for embedding for NAID {na_id}. Skipping.")
+                    continue
             
-            # --- Insert into MongoDB ---
-            try:
-                collection.insert_one(mongo_doc)
-                print(f"  - Successfully inserted multimodal document for NAID {na_id}.")
-                processed_count += 1
-            except Exception as e:
-                print(f"  - Failed to insert document for NAID {na_id} into MongoDB: {e}")
+                print(f"  - Preparing to embed {len(pil_images)} image(s) for NAID {na_id}.")
+            
+                # --- Construct MongoDB Document ---
+                # Create a single document for the entire record's media files
+                mongo_doc = {
+                    "_id": f"{na_id}",
+                    "naId": na_id,
+                    "title": record_metadata.get('title'),
+                    "subtitle": record_metadata.get('subtitle'),
+                    "scopeAndContentNote": record_metadata.get('scopeAndContentNote'),
+                    "source_file_names": [obj.get('objectFilename') for obj in digital_objects],
+                    "source_s3_paths": [obj.get('objectUrl') for obj in digital_objects],
+                    "file_type": file_extension,
+                    "embedding": None
+                }
+
+                # --- Embed in batches with Voyage AI and queue for MongoDB ---
+                # Each input is the list of PIL.Image objects for one record
+                batch_inputs.append(pil_images)
+                batch_docs.append(mongo_doc)
+                if len(batch_inputs) >= EMBED_BATCH_SIZE:
+                    pending_docs.extend(embed_batch(batch_inputs, batch_docs))
+                    processed_count += flush_documents(collection, pending_docs)
+    finally:
+        executor.shutdown(cancel_futures=True)
+        pending_docs.extend(embed_batch(batch_inputs, batch_docs))
+        processed_count += flush_documents(collection, pending_docs, force=True)
 
     print(f"\n--- Image embedding complete. Processed {processed_count} documents. ---")
 
@@ -253,6 +493,7 @@ def main():
     print(f"Records directory: {NARA_RECORDS_DIR}")
     print(f"Downloads directory: {NARA_DOWNLOADS_DIR}")
     print(f"MongoDB: {DB_NAME}.{COLLECTION_NAME}")
+    print(f"Embedding model: {EMBEDDING_MODEL}")
     print(f"Max image dimension: {MAX_IMAGE_DIM}px")
     
     process_and_embed_media_files()